@@ -2,13 +2,16 @@ import streamlit as st
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
-from sklearn.cluster import KMeans
-from ortools.constraint_solver import routing_enums_pb2
-from ortools.constraint_solver import pywrapcp
 import folium
+from folium.plugins import FastMarkerCluster
 from streamlit_folium import folium_static
-from math import radians, sin, cos, sqrt, atan2
-import random
+from math import sin, cos, sqrt, asin
+
+try:
+    from numba import njit, prange
+    NUMBA_AVAILABLE = True
+except ImportError:  # fall back to the NumPy path
+    NUMBA_AVAILABLE = False
 
 # Page Config
 st.set_page_config(
@@ -45,8 +48,10 @@ st.markdown("""
     </style>
     """, unsafe_allow_html=True)
 
-# Indian Cities Sample Data
-def generate_indian_sample_data(num_locations=30):
+# Indian Cities Sample Data (cached per num_locations/seed across reruns)
+@st.cache_data(max_entries=32)
+def generate_indian_sample_data(num_locations=30, seed=42):
+    rng = np.random.default_rng(seed)
     indian_cities = {
         'Mumbai': (19.0760, 72.8777),
         'Delhi': (28.7041, 77.1025),
@@ -59,72 +64,138 @@ def generate_indian_sample_data(num_locations=30):
         'Ahmedabad': (23.0225, 72.5714),
         'Lucknow': (26.8467, 80.9462)
     }
+    city_names = np.array(list(indian_cities.keys()))
+    base = np.array(list(indian_cities.values()))
     
-    data = []
-    for i in range(num_locations):
-        city = random.choice(list(indian_cities.keys()))
-        lat, lon = indian_cities[city]
-        # Add small variations to coordinates
-        lat += random.uniform(-0.05, 0.05)
-        lon += random.uniform(-0.05, 0.05)
-        
-        # Indian waste characteristics
-        waste_types = ['Residential', 'Commercial', 'Construction', 'Organic']
-        waste_volume = random.uniform(0.5, 5.0)
-        frequency = random.choice([1, 2, 3])  # Typical Indian collection frequencies
-        
-        data.append({
-            'Location_ID': f'LOC_{i+1:03d}',
-            'City': city,
-            'Latitude': lat,
-            'Longitude': lon,
-            'Waste_Volume': waste_volume,
-            'Waste_Type': random.choice(waste_types),
-            'Collection_Frequency': frequency,
-            'Last_Collection': pd.Timestamp.now() - pd.Timedelta(days=random.randint(0, 7))
-        })
+    # Draw every column in one batch instead of row by row
+    city_idx = rng.integers(0, len(city_names), num_locations)
+    # Add small variations to coordinates
+    lat = base[city_idx, 0] + rng.uniform(-0.05, 0.05, num_locations)
+    lon = base[city_idx, 1] + rng.uniform(-0.05, 0.05, num_locations)
+    
+    # Indian waste characteristics
+    waste_types = np.array(['Residential', 'Commercial', 'Construction', 'Organic'])
+    waste_volume = rng.uniform(0.5, 5.0, num_locations)
+    frequency = rng.integers(1, 4, num_locations)  # Typical Indian collection frequencies
+    days_since = rng.integers(0, 8, num_locations)
     
-    return pd.DataFrame(data)
+    return pd.DataFrame({
+        'Location_ID': [f'LOC_{i+1:03d}' for i in range(num_locations)],
+        'City': city_names[city_idx],
+        'Latitude': lat,
+        'Longitude': lon,
+        'Waste_Volume': waste_volume,
+        'Waste_Type': waste_types[rng.integers(0, len(waste_types), num_locations)],
+        'Collection_Frequency': frequency,
+        'Last_Collection': pd.Timestamp.now() - pd.to_timedelta(days_since, unit='D')
+    })
 
 # Indian Road Distance Calculation (approximation)
-def indian_road_distance(lat1, lon1, lat2, lon2):
-    # Haversine distance with 30% extra for Indian road conditions
+def indian_road_distance_matrix_rad(lat, lon):
+    # Vectorized Haversine over all pairs (inputs already in radians),
+    # 30% extra for Indian road conditions
     R = 6371  # Earth radius in km
-    lat1, lon1, lat2, lon2 = map(radians, [lat1, lon1, lat2, lon2])
-    dlat = lat2 - lat1
-    dlon = lon2 - lon1
-    a = sin(dlat/2)**2 + cos(lat1) * cos(lat2) * sin(dlon/2)**2
-    c = 2 * atan2(sqrt(a), sqrt(1-a))
-    distance = R * c * 1.3  # 30% extra for Indian road conditions
-    return distance
+    lat = np.asarray(lat)
+    lon = np.asarray(lon)
+    dlat = lat[:, None] - lat[None, :]
+    dlon = lon[:, None] - lon[None, :]
+    cos_lat = np.cos(lat)  # computed once, broadcast along both axes
+    a = np.sin(dlat*0.5)**2 + cos_lat[:, None] * cos_lat[None, :] * np.sin(dlon*0.5)**2
+    c = 2 * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+    return R * c * 1.3  # 30% extra for Indian road conditions
+
+if NUMBA_AVAILABLE:
+    @njit(cache=True, fastmath=True)
+    def _haversine_rad(lat1, lon1, lat2, lon2):
+        R = 6371  # Earth radius in km
+        dlat = lat2 - lat1
+        dlon = lon2 - lon1
+        a = sin(dlat*0.5)**2 + cos(lat1) * cos(lat2) * sin(dlon*0.5)**2
+        a = min(max(a, 0.0), 1.0)  # Rounding can push a just outside [0, 1]
+        c = 2 * asin(sqrt(a))  # Same formula as the NumPy path
+        return R * c * 1.3  # 30% extra for Indian road conditions
+
+    @njit(cache=True, parallel=True, fastmath=True)
+    def _build_matrix(lat_rad, lon_rad):
+        n = lat_rad.shape[0]
+        out = np.zeros((n, n), dtype=lat_rad.dtype)
+        for i in prange(n):
+            # Distance is symmetric: compute the upper triangle and mirror it
+            for j in range(i + 1, n):
+                d = _haversine_rad(lat_rad[i], lon_rad[i], lat_rad[j], lon_rad[j])
+                out[i, j] = d
+                out[j, i] = d
+        return out
+
+    # Warm up once at import so the first optimize click doesn't pay compile time
+    _build_matrix(np.zeros(2, dtype=np.float32), np.zeros(2, dtype=np.float32))
+
+# Cached distance matrix (radian coordinates passed as tuples so they hash cheaply).
+# float32 halves memory traffic; precision stays far below the 30% road factor.
+@st.cache_data(ttl=3600, max_entries=32)
+def build_distance_matrix(lat_rad, lon_rad):
+    lat_rad = np.asarray(lat_rad, dtype=np.float32)
+    lon_rad = np.asarray(lon_rad, dtype=np.float32)
+    if NUMBA_AVAILABLE:
+        return _build_matrix(lat_rad, lon_rad)
+    return indian_road_distance_matrix_rad(lat_rad, lon_rad)
+
+# Heavy solver libraries are imported only when a solve needs them, so start-up
+# and widget reruns that never click Optimize skip the import cost
+def _load_ortools():
+    from ortools.constraint_solver import routing_enums_pb2
+    from ortools.constraint_solver import pywrapcp
+    return routing_enums_pb2, pywrapcp
+
+def _load_kmeans():
+    from sklearn.cluster import KMeans
+    return KMeans
 
 # OR-Tools Vehicle Routing Solution (optimized for Indian conditions)
-def optimize_indian_routes(distance_matrix, num_vehicles=3, depot=0):
-    manager = pywrapcp.RoutingIndexManager(len(distance_matrix), num_vehicles, depot)
-    routing = pywrapcp.RoutingModel(manager)
+def optimize_indian_routes(distance_matrix, num_vehicles=3, depot=0, time_limit=10):
+    # Convert to meters for OR-Tools; the raw bytes key the solution cache
+    int_matrix = (np.asarray(distance_matrix) * 1000).astype(np.int64)
+    return _solve(int_matrix.tobytes(), len(int_matrix), num_vehicles, depot, time_limit)
+
+MAX_ROUTE_METERS = 60000  # 60km max distance per vehicle
+
+# Cached solve: identical inputs return the previous routes instantly
+@st.cache_data(show_spinner=False, max_entries=16)
+def _solve(matrix_bytes, n, num_vehicles, depot, time_limit):
+    routing_enums_pb2, pywrapcp = _load_ortools()
     
-    def distance_callback(from_index, to_index):
-        from_node = manager.IndexToNode(from_index)
-        to_node = manager.IndexToNode(to_index)
-        return int(distance_matrix[from_node][to_node] * 1000)  # Convert to meters for OR-Tools
+    # The solver reads this matrix directly in C++
+    int_matrix = np.frombuffer(matrix_bytes, dtype=np.int64).reshape(n, n).tolist()
     
-    transit_callback_index = routing.RegisterTransitCallback(distance_callback)
+    manager = pywrapcp.RoutingIndexManager(n, num_vehicles, depot)
+    routing = pywrapcp.RoutingModel(manager)
+    
+    transit_callback_index = routing.RegisterTransitMatrix(int_matrix)
     routing.SetArcCostEvaluatorOfAllVehicles(transit_callback_index)
     
     # Add Indian-specific constraints
     routing.AddDimension(
         transit_callback_index,
         0,  # no slack
-        60000,  # 60km max distance per vehicle (in meters)
+        MAX_ROUTE_METERS,  # max distance per vehicle (in meters)
         True,  # start cumul to zero
         'Distance')
+    distance_dimension = routing.GetDimensionOrDie('Distance')
+    # Balances route lengths when several vehicles share one solve; the clustered
+    # path solves one vehicle per cluster, where this only rescales the objective
+    distance_dimension.SetGlobalSpanCostCoefficient(10000)
     
+    # First solution strategy left at AUTOMATIC; spend the remaining time improving the tour
     search_parameters = pywrapcp.DefaultRoutingSearchParameters()
-    search_parameters.first_solution_strategy = (
-        routing_enums_pb2.FirstSolutionStrategy.PATH_CHEAPEST_ARC)
-    search_parameters.time_limit.seconds = 10  # Faster computation
+    search_parameters.local_search_metaheuristic = (
+        routing_enums_pb2.LocalSearchMetaheuristic.GUIDED_LOCAL_SEARCH)
+    search_parameters.time_limit.FromMilliseconds(int(time_limit * 1000))
+    search_parameters.log_search = False
+    search_parameters.use_full_propagation = True
     
     solution = routing.SolveWithParameters(search_parameters)
+    if solution is None:
+        return None  # No route satisfies the distance cap
     
     routes = []
     for vehicle_id in range(num_vehicles):
@@ -139,6 +210,62 @@ def optimize_indian_routes(distance_matrix, num_vehicles=3, depot=0):
     
     return routes
 
+# Fitted KMeans per coordinate set, reused across repeated optimize clicks
+@st.cache_resource(max_entries=16)
+def _fit_kmeans(lats, lons, num_vehicles):
+    KMeans = _load_kmeans()
+    coords = np.column_stack([lats, lons])
+    return KMeans(n_clusters=num_vehicles, n_init=10, random_state=0).fit(coords)
+
+# Geographic decomposition: one small single-vehicle problem per KMeans cluster.
+# Clusters that can't fit under the distance cap (e.g. spanning two cities) are
+# split in two until they do, so the number of routes can exceed num_vehicles.
+# The clusters share the overall time limit so a click stays within the slider value.
+def optimize_clustered_routes(df, distance_matrix, num_vehicles=3, time_limit=10):
+    coords = df[['Latitude', 'Longitude']].to_numpy()
+    labels = _fit_kmeans(tuple(coords[:, 0]), tuple(coords[:, 1]), num_vehicles).labels_
+    pending = [np.flatnonzero(labels == k) for k in range(num_vehicles)]
+    
+    def split(nodes):
+        halves = _fit_kmeans(tuple(coords[nodes, 0]), tuple(coords[nodes, 1]), 2).labels_
+        return [nodes[halves == 0], nodes[halves == 1]]
+    
+    # One vehicle must visit every stop, so its tour is at least twice the widest
+    # pair apart; split clusters where that already breaks the cap
+    clusters = []
+    while pending:
+        nodes = pending.pop()
+        if len(nodes) == 0:
+            continue
+        if 2 * distance_matrix[np.ix_(nodes, nodes)].max() * 1000 > MAX_ROUTE_METERS:
+            pending.extend(split(nodes))
+        else:
+            clusters.append(nodes)
+    cluster_time_limit = time_limit / len(clusters)
+    
+    routes = []
+    while clusters:
+        nodes = clusters.pop(0)
+        sub_matrix = distance_matrix[np.ix_(nodes, nodes)]
+        solved = optimize_indian_routes(sub_matrix, num_vehicles=1, depot=0,
+                                        time_limit=cluster_time_limit)
+        if solved is None:
+            clusters.extend(split(nodes))  # Tour still too long; a single stop always fits
+            continue
+        routes.append(nodes[solved[0]].tolist())  # Map back to indices in df
+    return routes
+
+# Client-side marker factory for FastMarkerCluster rows of [lat, lon, popup, color, icon]
+MARKER_CALLBACK = """
+    function (row) {
+        var icon = L.AwesomeMarkers.icon({icon: row[4], markerColor: row[3]});
+        var marker = L.marker(new L.LatLng(row[0], row[1]));
+        marker.setIcon(icon);
+        marker.bindPopup(row[2]);
+        return marker;
+    }
+"""
+
 # Main App
 st.title("🗑️ Indian Smart Waste Collection Optimizer")
 st.markdown("""
@@ -154,12 +281,14 @@ with st.sidebar:
     st.title("Configuration")
     
     num_locations = st.slider("Number of Locations", 10, 100, 30)
+    seed = st.number_input("Random Seed", min_value=0, max_value=10000, value=42, step=1)
     selected_city = st.selectbox("Select Base City", 
                                ['Mumbai', 'Delhi', 'Bangalore', 'Hyderabad', 'Chennai'])
     
     st.subheader("Vehicle Parameters")
     num_vehicles = st.slider("Number of Vehicles", 1, 10, 3)
     vehicle_capacity = st.slider("Vehicle Capacity (tons)", 1, 10, 5)
+    time_limit = st.slider("Solver Time Limit (seconds)", 1, 60, 10)
     
     st.markdown("---")
     st.subheader("Indian Waste Patterns")
@@ -172,12 +301,15 @@ with st.sidebar:
     """)
 
 # Load Indian Data
-df = generate_indian_sample_data(num_locations)
+df = generate_indian_sample_data(num_locations, int(seed))
+# Convert to radians once; underscore columns are internal and not displayed
+df['_lat_rad'] = np.radians(df['Latitude'])
+df['_lon_rad'] = np.radians(df['Longitude'])
 st.success(f"✅ Generated sample data for {selected_city} region with {num_locations} locations")
 
 # Data Preview
 with st.expander("🔍 Data Preview", expanded=True):
-    st.dataframe(df.head())
+    st.dataframe(df.filter(regex='^[^_]').head())
     
     # Show on map with proper attribution
     m = folium.Map(
@@ -186,13 +318,15 @@ with st.expander("🔍 Data Preview", expanded=True):
         tiles='OpenStreetMap',
         attr='© <a href="https://www.openstreetmap.org/copyright">OpenStreetMap</a> contributors'
     )
-    for idx, row in df.iterrows():
-        folium.Marker(
-            [row['Latitude'], row['Longitude']],
-            popup=f"{row['Location_ID']}<br>{row['City']}<br>Waste: {row['Waste_Volume']} tons",
-            icon=folium.Icon(color='orange' if row['Waste_Type'] == 'Residential' else 
-                           'blue' if row['Waste_Type'] == 'Commercial' else 'green')
-        ).add_to(m)
+    # Ship all markers as one JS array and cluster them in the browser
+    markers = pd.DataFrame({
+        'lat': df['Latitude'],
+        'lon': df['Longitude'],
+        'popup': df['Location_ID'] + '<br>' + df['City'] + '<br>Waste: ' + df['Waste_Volume'].astype(str) + ' tons',
+        'color': df['Waste_Type'].map({'Residential': 'orange', 'Commercial': 'blue'}).fillna('green'),
+        'icon': 'info-sign'
+    })
+    FastMarkerCluster(markers.values.tolist(), callback=MARKER_CALLBACK).add_to(m)
     folium_static(m, width=1000, height=400)
 
 # Optimization
@@ -200,28 +334,28 @@ st.header("🚛 Route Optimization for Indian Conditions")
 if st.button("🚀 Optimize Collection Routes", key="optimize"):
     with st.spinner('Optimizing routes for Indian road conditions...'):
         # Create distance matrix with Indian road adjustments
-        distance_matrix = np.zeros((len(df), len(df)))
-        for i in range(len(df)):
-            for j in range(len(df)):
-                if i != j:
-                    distance_matrix[i][j] = indian_road_distance(
-                        df.iloc[i]['Latitude'], df.iloc[i]['Longitude'],
-                        df.iloc[j]['Latitude'], df.iloc[j]['Longitude']
-                    )
+        lat_rad = df['_lat_rad'].to_numpy(np.float32)
+        lon_rad = df['_lon_rad'].to_numpy(np.float32)
+        distance_matrix = build_distance_matrix(tuple(lat_rad), tuple(lon_rad))
         
         # Optimize routes
-        routes = optimize_indian_routes(distance_matrix, num_vehicles)
+        routes = optimize_clustered_routes(df, distance_matrix, num_vehicles, time_limit=time_limit)
+        if len(routes) > num_vehicles:
+            st.warning(f"Locations span more cities than vehicles: {len(routes)} routes were "
+                       f"needed to keep each under 60 km, so {num_vehicles} vehicles will "
+                       f"need multiple trips (about one vehicle per sampled city avoids this).")
         
         # Visualize results
         st.success("Optimization complete!")
         
         # Create optimized routes dataframe
-        optimized_routes = pd.DataFrame()
+        pieces = []
         for vehicle_id, route in enumerate(routes):
             route_df = df.iloc[route].copy()
             route_df['Vehicle'] = f"Vehicle {vehicle_id+1}"
             route_df['Route_Order'] = range(len(route))
-            optimized_routes = pd.concat([optimized_routes, route_df])
+            pieces.append(route_df)
+        optimized_routes = pd.concat(pieces, ignore_index=True)
         
         # Show on map with proper attribution
         st.subheader("Optimized Routes")
@@ -245,31 +379,32 @@ if st.button("🚀 Optimize Collection Routes", key="optimize"):
                 popup=vehicle_id
             ).add_to(route_map)
             
-            for idx, row in group.iterrows():
-                folium.Marker(
-                    [row['Latitude'], row['Longitude']],
-                    popup=f"{row['Location_ID']}<br>{vehicle_id}<br>Order: {row['Route_Order']}",
-                    icon=folium.Icon(color=color, icon='trash')
-                ).add_to(route_map)
+            markers = pd.DataFrame({
+                'lat': group['Latitude'],
+                'lon': group['Longitude'],
+                'popup': group['Location_ID'] + f'<br>{vehicle_id}<br>Order: ' + group['Route_Order'].astype(str),
+                'color': color,
+                'icon': 'trash'
+            })
+            FastMarkerCluster(markers.values.tolist(), callback=MARKER_CALLBACK).add_to(route_map)
         
         folium_static(route_map, width=1000, height=500)
         
         # Calculate metrics
         total_distance = 0
-        for vehicle_id, group in optimized_routes.groupby('Vehicle'):
-            coords = group[['Latitude', 'Longitude']].values
-            vehicle_distance = sum(indian_road_distance(coords[i][0], coords[i][1], 
-                                 coords[i+1][0], coords[i+1][1]) 
-                            for i in range(len(coords)-1))
+        for vehicle_id, route in enumerate(routes):
+            # Sum consecutive legs straight from the precomputed matrix
+            r = np.asarray(route, dtype=np.intp)
+            vehicle_distance = distance_matrix[r[:-1], r[1:]].sum()
             total_distance += vehicle_distance
-            st.info(f"{vehicle_id}: {len(group)} locations, {vehicle_distance:.2f} km")
+            st.info(f"Vehicle {vehicle_id+1}: {len(route)} locations, {vehicle_distance:.2f} km")
         
         st.metric("Total System Distance", f"{total_distance:.2f} km")
         
         # Download results
         st.download_button(
             label="📥 Download Optimized Routes (CSV)",
-            data=optimized_routes.to_csv(index=False).encode('utf-8'),
+            data=optimized_routes.filter(regex='^[^_]').to_csv(index=False).encode('utf-8'),
             file_name="optimized_routes_india.csv",
             mime="text/csv"
         )